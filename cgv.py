@@ -9,30 +9,43 @@ visualize your glucose data measured by hand or
 by a glucose measurement system (CGM)
 """
 
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import hashlib
+import multiprocessing
+import os
 from pathlib import Path
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
 import matplotlib as mpl
 import subprocess
-
-# Use the pgf backend (must be set before pyplot imported)
-mpl.use("pgf")
-mpl.rcParams.update(
-    {
-        "pgf.texsystem": "pdflatex",
-        "font.family": "serif",
-        "text.usetex": True,
-        "pgf.rcfonts": False,
-    }
-)
 import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter
 
 
 from datetime import timedelta, date
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+FIGURE_FOLDER = "./figures/"
+
 
+@functools.cache
+def _configure_pgf() -> None:
+    """use the pgf backend (once per process)"""
+    mpl.use("pgf")
+    mpl.rcParams.update(
+        {
+            "pgf.texsystem": "pdflatex",
+            "font.family": "serif",
+            "pgf.rcfonts": False,
+            "agg.path.chunksize": 10000,
+        }
+    )
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Week:
 
     """
@@ -43,17 +56,37 @@ class Week:
 
     first_day: date
     week_number: int
+    _last_day: date = field(init=False, repr=False, compare=False)
+    _calender_week: int = field(init=False, repr=False, compare=False)
+    _year: int = field(init=False, repr=False, compare=False)
+    _time_span: str = field(init=False, repr=False, compare=False)
+    _file_name: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        """compute the values derived from ``first_day`` once"""
+        last_day = self.first_day + timedelta(days=6)
+        iso_calendar = self.first_day.isocalendar()
+        time_span = (
+            self.first_day.strftime(self.dateformat())
+            + " - "
+            + last_day.strftime(self.dateformat())
+        )
+        object.__setattr__(self, "_last_day", last_day)
+        object.__setattr__(self, "_calender_week", iso_calendar.week)
+        object.__setattr__(self, "_year", iso_calendar.year)
+        object.__setattr__(self, "_time_span", time_span)
+        object.__setattr__(self, "_file_name", f"Week{self.week_number}-{time_span}")
 
     @property
     def last_day(self) -> date:
         """last day of the week"""
-        return self.first_day + timedelta(days=6)
+        return self._last_day
 
     def calender_week(self) -> int:
-        return self.first_day.isocalendar().week
+        return self._calender_week
 
     def year(self) -> int:
-        return self.first_day.isocalendar().year
+        return self._year
 
     def inside_week(self, day: date) -> bool:
         """check if given ``day`` is inside week"""
@@ -64,15 +97,15 @@ class Week:
 
     def time_span(self) -> str:
         """print the time-span of the week"""
-        return (
-            self.first_day.strftime(self.dateformat())
-            + " - "
-            + self.last_day.strftime(self.dateformat())
-        )
+        return self._time_span
 
     def dateformat(self) -> str:
         return "%d.%m.%Y"
 
+    def file_name(self) -> str:
+        """file-name of the plot of the week without file-extension"""
+        return self._file_name
+
 
 class CGV:
 
@@ -87,32 +120,100 @@ class CGV:
         csv_path: str,
         date_column: str = "Gerätezeitstempel",
         glucose_column: str = "Glukosewert-Verlauf mmol/L",
+        resample_rule: str | None = "15min",
+        figure_format: str = "pgf",
     ):
         self.csv_path = Path(csv_path)
-        self.data = pd.read_csv(self.csv_path, sep=",", header=1)
-        if date_column in self.data.columns:
-            self.date_column = date_column
-        else:
-            ValueError(
-                f"Column-Name {date_column} is not given in the provided csv-file"
+        self.date_column = date_column
+        self.glucose_column = glucose_column
+        self.resample_rule = resample_rule
+        if figure_format not in ("pgf", "pdf"):
+            raise ValueError(
+                f"figure_format must be 'pgf' or 'pdf', not '{figure_format}'"
             )
-        if glucose_column in self.data.columns:
-            self.glucose_column = glucose_column
-        else:
-            ValueError(
-                f"Column-Name {glucose_column} is not given in the provided csv-file"
-            )
-        self.data = self.data[
-            self.data[self.date_column].notna() & self.data[self.glucose_column].notna()
-        ]
-        self.data[self.date_column] = pd.to_datetime(
-            self.data[self.date_column], format="%m-%d-%Y %H:%M"
-        )
+        self.figure_format = figure_format
+        if self.figure_format == "pgf":
+            _configure_pgf()
+        self._load_data()
         self.data.sort_values(by=self.date_column, inplace=True)
+        self._date_np = self.data[self.date_column].values
         self.weeks = self.segmenting_time_period()
-        self.data[self.glucose_column] = self.convert_glucose_data()
+        self._week_starts = [week.first_day for week in self.weeks.values()]
         self._add_figure_folder()
 
+    @property
+    def parquet_path(self) -> Path:
+        """
+        path of the parquet-file caching the parsed csv-file
+
+        the file-name contains a hash of the selected columns,
+        so that each selection of columns has its own cache
+        """
+        columns = f"{self.date_column}\n{self.glucose_column}".encode()
+        digest = hashlib.sha1(columns).hexdigest()[:8]
+        return self.csv_path.with_name(f"{self.csv_path.stem}.{digest}.parquet")
+
+    def _parquet_is_up_to_date(self) -> bool:
+        """check if the parquet-file exists and is not older than the csv-file"""
+        return (
+            self.parquet_path.exists()
+            and self.parquet_path.stat().st_mtime >= self.csv_path.stat().st_mtime
+        )
+
+    def _load_data(self) -> None:
+        """
+        load the data from the parquet-file if it is up to date,
+        otherwise parse the csv-file and (re-)write the parquet-file
+        """
+        if self._parquet_is_up_to_date():
+            try:
+                self.data = pd.read_parquet(
+                    self.parquet_path, columns=[self.date_column, self.glucose_column]
+                )
+                return
+            except (ImportError, ValueError):
+                # no parquet-engine installed or cache not readable
+                pass
+        self.data = self._read_csv()
+        try:
+            self.data.to_parquet(self.parquet_path, compression="zstd")
+        except (ImportError, OSError):
+            # caching is optional
+            pass
+
+    def _read_csv(self, chunksize: int = 500_000) -> pd.DataFrame:
+        """
+        read the date- and glucose-column from the csv-file
+
+        the file is read in chunks of ``chunksize`` rows and rows
+        missing one of the values are dropped per chunk
+        """
+        columns = pd.read_csv(self.csv_path, sep=",", header=1, nrows=0).columns
+        for column in (self.date_column, self.glucose_column):
+            if column not in columns:
+                raise ValueError(
+                    f"Column-Name {column} is not given in the provided csv-file"
+                )
+        chunks = pd.read_csv(
+            self.csv_path,
+            sep=",",
+            header=1,
+            usecols=[self.date_column, self.glucose_column],
+            dtype={self.glucose_column: "float64"},
+            decimal=",",
+            thousands=None,
+            parse_dates=[self.date_column],
+            date_format="%m-%d-%Y %H:%M",
+            chunksize=chunksize,
+        )
+        data = pd.concat((chunk.dropna() for chunk in chunks), ignore_index=True)
+        if not is_datetime64_any_dtype(data[self.date_column]):
+            raise ValueError(
+                f"Column {self.date_column} does not match the date-format "
+                "%m-%d-%Y %H:%M"
+            )
+        return data
+
     @property
     def dates(self) -> pd.Series:
         """dates in the data"""
@@ -125,10 +226,9 @@ class CGV:
 
     def _add_figure_folder(self) -> None:
         """adds figure-folder"""
-        if not Path("./figures/").exists():
-            Path("./figures/").mkdir()
+        Path(FIGURE_FOLDER).mkdir(parents=True, exist_ok=True)
 
-    def segmenting_time_period(self, days_per_segment=7) -> list[Week]:
+    def segmenting_time_period(self, days_per_segment=7) -> dict[int, Week]:
         """
         partitioning the full period into segements
         """
@@ -136,37 +236,53 @@ class CGV:
         if first_day.weekday() > 0:
             first_day = first_day - timedelta(first_day.weekday())
         last_day = self.dates.max().date()
-        first_week_day = first_day
-        weeks = []
-        week = 0
-        while first_week_day < last_day:
-            first_week_day = first_week_day + timedelta(days_per_segment)
-            week += 1
-            weeks.append(Week(first_week_day, week))
-        return weeks
+        first_week_days = pd.date_range(
+            start=first_day, end=last_day, freq=f"{days_per_segment}D"
+        ).date
+        return {
+            week: Week(first_week_day, week)
+            for week, first_week_day in enumerate(first_week_days, start=1)
+        }
 
     def convert_glucose_data(self) -> pd.Series:
         """
         convert glucose-data saved as string with comma as decimal
         to numeric values
+
+        glucose-data read by :py:meth:`_read_csv` is already numeric
         """
         glucose_data = self.data[self.glucose_column]
-        glucose_data = glucose_data.str.replace(pat=",", repl=".")
-        return pd.to_numeric(glucose_data)
-
-    def plot_week(self, week: int | Week) -> str:
-        """plot the data within the given ``week_number``"""
-        if isinstance(week, int):
-            week = list(filter(lambda x: x.week_number == week, self.weeks))[0]
-        filter_week = (week.first_day <= self.data[self.date_column].dt.date) & (
-            self.data[self.date_column].dt.date <= week.last_day
+        if is_numeric_dtype(glucose_data):
+            return glucose_data
+        glucose_data = glucose_data.str.replace(pat=",", repl=".", regex=False)
+        return pd.to_numeric(glucose_data, errors="raise")
+
+    def week_data(self, week: Week) -> pd.DataFrame:
+        """data within the given ``week``"""
+        lo = np.searchsorted(self._date_np, np.datetime64(week.first_day))
+        hi = np.searchsorted(
+            self._date_np, np.datetime64(week.last_day) + np.timedelta64(1, "D")
         )
-        week_data = self.data[filter_week]
-        if len(week_data) == 0:
-            print(f"In week {week} does no data exist")
-            return
-        fig, ax = plt.subplots(figsize=(18 * 0.39, 5.0 * 0.39))
-        ax.plot(week_data[self.date_column], week_data[self.glucose_column])
+        return self.data.iloc[lo:hi]
+
+    def resample(self, week_data: pd.DataFrame) -> pd.Series:
+        """
+        glucose-values of ``week_data`` averaged over intervals of
+        ``resample_rule`` (no resampling if ``resample_rule`` is ``None``)
+        """
+        glucose = week_data.set_index(self.date_column)[self.glucose_column]
+        if self.resample_rule is None:
+            return glucose
+        return glucose.resample(self.resample_rule).mean().dropna()
+
+    def _figure(self) -> tuple[plt.Figure, plt.Axes]:
+        """create figure and axes for plotting a week"""
+        return plt.subplots(figsize=(18 * 0.39, 5.0 * 0.39))
+
+    def _render_week(self, ax: plt.Axes, week: Week, week_data: pd.DataFrame) -> None:
+        """draw the ``week_data`` of the given ``week`` on ``ax``"""
+        plot_series = self.resample(week_data)
+        ax.plot(plot_series.index, plot_series.values, rasterized=True)
         ax.set_ylabel("Glukose [mmol/L]")
         date_form = DateFormatter("%a")
         ax.xaxis.set_major_formatter(date_form)
@@ -182,50 +298,181 @@ class CGV:
             y2=3.9,
             color="lightgray",
         )
+
+    def _save_week(
+        self, fig: plt.Figure, ax: plt.Axes, week: Week, week_data: pd.DataFrame
+    ) -> str:
+        """draw the ``week`` on the cleared ``ax`` and save ``fig``"""
+        ax.clear()
+        self._render_week(ax, week, week_data)
         path = self.plot_path(week)
-        fig.savefig(path, format="pgf")
+        # the backend is given explicitly, as the canvas of the pgf-backend
+        # would compile pdf-files with LaTeX
+        fig.savefig(
+            path, format=self.figure_format, backend=self.figure_format, dpi=150
+        )
+        return path
+
+    def plot_week(self, week: int | Week) -> str | None:
+        """
+        plot the data within the given ``week_number``
+
+        returns ``None`` without creating a figure if the week has no data
+        """
+        if isinstance(week, int):
+            week = self.weeks[week]
+        week_data = self.week_data(week)
+        if len(week_data) == 0:
+            print(f"In week {week} does no data exist")
+            return None
+        fig, ax = self._figure()
+        path = self._save_week(fig, ax, week, week_data)
+        plt.close(fig)
         return path
 
     def plot_path(self, week: Week):
-        return f"./figures/Week{week.week_number}-{week.time_span()}.pgf"
+        return f"{FIGURE_FOLDER}{week.file_name()}.{self.figure_format}"
 
     def plot_last_week(self) -> list[str]:
-        last_week = max(self.weeks.keys())
-        return [self.plot_week(last_week)]
+        last_week = max(self.weeks)
+        path = self.plot_week(last_week)
+        return [path] if path is not None else []
 
     def plot_all_weeks(self) -> list[str]:
-        first_week = min(self.weeks.keys())
-        last_week = max(self.weeks.keys())
+        first_week = min(self.weeks)
+        last_week = max(self.weeks)
         return self.plot_week_range(first_week, last_week)
 
-    def plot_week_range(self, first_week: int, last_week: int) -> list[str]:
+    def plot_week_range(
+        self, first_week: int, last_week: int, processes: int = 1
+    ) -> list[str]:
+        """
+        plot the weeks from ``first_week`` to ``last_week``
+
+        with ``processes > 1`` the weeks are split into consecutive blocks
+        that are plotted by worker-processes. Each worker loads the data
+        again from ``csv_path`` (changes of ``data`` in memory are ignored).
+        The workers are started with the spawn-method, therefore the calling
+        script must be guarded by ``if __name__ == "__main__":``
+        """
+        week_numbers = list(range(first_week, last_week + 1))
+        processes = min(processes, len(week_numbers))
+        if processes <= 1:
+            return self._plot_weeks(week_numbers)
+        blocks = [block.tolist() for block in np.array_split(week_numbers, processes)]
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(
+                self.csv_path,
+                self.date_column,
+                self.glucose_column,
+                self.resample_rule,
+                self.figure_format,
+            ),
+        ) as executor:
+            return [
+                path for paths in executor.map(_plot_weeks, blocks) for path in paths
+            ]
+
+    def _plot_weeks(self, week_numbers: list[int]) -> list[str]:
+        """
+        plot the weeks with the given ``week_numbers``
+
+        all weeks are drawn on the same figure, weeks without data are skipped
+        """
+        fig = ax = None
         paths = []
-        for week in range(first_week, last_week):
-            paths.append(self.plot_week(week))
+        for week_number in week_numbers:
+            week = self.weeks[week_number]
+            week_data = self.week_data(week)
+            if len(week_data) == 0:
+                print(f"In week {week} does no data exist")
+                continue
+            if fig is None:
+                fig, ax = self._figure()
+            paths.append(self._save_week(fig, ax, week, week_data))
+        if fig is not None:
+            plt.close(fig)
         return paths
 
     def plot_since_three_month(self) -> list[str]:
         starting_date = date.today() - timedelta(weeks=3 * 4)
-        for week in self.weeks:
-            if week.inside_week(starting_date):
-                starting_week = week.week_number
-        return self.plot_week_range(starting_week, len(self.weeks))
+        if starting_date > self.weeks[max(self.weeks)].last_day:
+            return []
+        index = max(0, bisect.bisect_right(self._week_starts, starting_date) - 1)
+        # weeks are numbered consecutively starting with 1
+        starting_week = index + 1
+        return self.plot_week_range(starting_week, max(self.weeks))
 
     def date_format(self) -> str:
         return "%d-%m-%Y"
 
 
+_worker_cgv: CGV | None = None
+
+
+def _init_worker(
+    csv_path: Path,
+    date_column: str,
+    glucose_column: str,
+    resample_rule: str | None,
+    figure_format: str,
+) -> None:
+    """load the data once per worker-process (from the parquet-file if available)"""
+    global _worker_cgv
+    _worker_cgv = CGV(
+        csv_path, date_column, glucose_column, resample_rule, figure_format
+    )
+
+
+def _plot_weeks(week_numbers: list[int]) -> list[str]:
+    """plot the given weeks in a worker-process"""
+    return _worker_cgv._plot_weeks(week_numbers)
+
+
 class PDF:
 
-    """create a pdf from the given pgf's using LaTeX"""
+    """
+    create a pdf from the given pgf's using LaTeX
 
-    def __init__(self, pgf_paths: list[str], file_name: str, name: str = None):
-        self.pgf_paths = [Path(pgf) for pgf in pgf_paths if Path(pgf).exists()]
+    pdf-files (see ``figure_format`` of :py:class:`CGV`) are only
+    included as graphics
+    """
+
+    def __init__(
+        self,
+        pgf_paths: list[str],
+        file_name: str,
+        name: str = None,
+        output_directory: str = ".",
+    ):
+        self.pgf_paths = self._existing_paths(pgf_paths)
         self._name = name
         self._file_name = file_name
+        self._output_directory = Path(output_directory)
         self.build_tex_file()
         self.compile_latex()
 
+    @staticmethod
+    def _existing_paths(paths: list[str]) -> list[str]:
+        """filter the existing files, listing each directory only once"""
+        paths = [str(path) for path in paths if path]
+        existing = {}
+        for directory in {os.path.dirname(path) for path in paths}:
+            try:
+                existing[directory] = {
+                    entry.name for entry in os.scandir(directory or ".")
+                }
+            except FileNotFoundError:
+                existing[directory] = set()
+        return [
+            path
+            for path in paths
+            if os.path.basename(path) in existing[os.path.dirname(path)]
+        ]
+
     def preamble(self) -> list[str]:
         """get the preamble of the LaTeX-document"""
         lines = [
@@ -234,33 +481,69 @@ class PDF:
             "\\usepackage[utf8]{inputenc}",
             "\\usepackage[ngerman]{babel}",
             "\\usepackage{txfonts}%",
-            "\\usepackage{pgfplots}",
+        ]
+        if any(path.endswith(".pgf") for path in self.pgf_paths):
+            lines += ["\\usepackage{pgfplots}", "\\usepackage{import}"]
+        else:
+            lines.append("\\usepackage{graphicx}")
+        lines += [
             "\\usepackage{scrlayer-scrpage}",
             f"\\ihead{{{self._name}}}",
             "\\ohead{Glukose-Werte}",
         ]
         return lines
 
+    def include(self, path: str) -> str:
+        """LaTeX-code including the figure at ``path``"""
+        if not path.endswith(".pgf"):
+            include = f"\\includegraphics[width=\\linewidth]{{{path}}}"
+        else:
+            # rasterized images are looked up relative to the pgf-file
+            directory, name = os.path.split(path)
+            include = f"\\import{{{directory or '.'}/}}{{{name}}}"
+        return f"\\begin{{center}}\n\t{include}\n\\end{{center}}\n"
+
     def document(self) -> list[str]:
         """build the document"""
-        lines = ["\\begin{document}", ""]
-        for path in self.pgf_paths:
-            lines.append("\\begin{center}")
-            lines.append(f"\t\\input{{{str(path)}}}")
-            lines.append("\\end{center}")
-            lines.append("")
-        lines.append("\\end{document}")
-        return lines
+        return [
+            "\\begin{document}",
+            "",
+            *(self.include(path) for path in self.pgf_paths),
+            "\\end{document}",
+        ]
 
     def build_tex_file(self) -> None:
         """buils the tex-file"""
-        lines = self.preamble() + self.document()
-        with open(self._file_name + ".tex", "w") as tex:
-            tex.write("\n".join(lines))
+        Path(self._file_name + ".tex").write_text(
+            "\n".join(self.preamble() + self.document()), encoding="utf-8"
+        )
 
     def compile_latex(self) -> None:
-        """compiles the LaTeX-document"""
-        subprocess.call(["pdflatex", self._file_name + ".tex"])
+        """
+        compiles the LaTeX-document
+
+        the pdf and the auxiliary files are written to ``output_directory``,
+        the log is found there in case of an error
+        """
+        self._output_directory.mkdir(parents=True, exist_ok=True)
+        try:
+            subprocess.run(
+                [
+                    "pdflatex",
+                    "-interaction=batchmode",
+                    "-halt-on-error",
+                    "-no-shell-escape",
+                    f"-output-directory={self._output_directory}",
+                    self._file_name + ".tex",
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+        except subprocess.CalledProcessError as error:
+            log = self._output_directory / (Path(self._file_name).name + ".log")
+            raise RuntimeError(
+                f"Compiling {self._file_name}.tex failed, see {log} for details"
+            ) from error
 
 
 if __name__ == "__main__":